@@ -3,6 +3,7 @@ import csv
 import io
 import xml.etree.ElementTree as ET
 from decimal import Decimal
+from xml.sax.saxutils import escape
 
 # Namespaces
 NS = 'urn:iso:std:iso:20022:tech:xsd:pain.001.001.09'
@@ -13,26 +14,97 @@ SCHEMA_LOCATION = f"{NS} pain.001.001.09.xsd"
 ET.register_namespace('', NS)
 ET.register_namespace('xsi', XSI)
 
-
+# CSV column positions (shared by the control row and the payment rows)
+COL_MSGID = 2
+COL_REMITTANCE = 2
+COL_DEBTOR_IBAN = 3
+COL_NAME = 4
+COL_ADDR1 = 5
+COL_ADDR2 = 6
+COL_BIC = 10
+COL_CURRENCY = 12
+COL_AMOUNT = 13
+COL_CREATED = 32
+COL_E2E = 34
+COL_IBAN = 35
+COL_REF = 36
+ROW_WIDTH = COL_REF + 1
+
+# One credit transfer; unqualified tags inherit the default namespace of Document
+TX_TEMPLATE = (
+    '<CdtTrfTxInf>'
+    '<PmtId><EndToEndId>{e2e}</EndToEndId></PmtId>'
+    '<Amt><InstdAmt Ccy="{ccy}">{amt}</InstdAmt></Amt>'
+    '<CdtrAgt><FinInstnId><BICFI>{bic}</BICFI></FinInstnId></CdtrAgt>'
+    '<Cdtr><Nm>{name}</Nm><PstlAdr>{adr}</PstlAdr></Cdtr>'
+    '<CdtrAcct><Id><IBAN>{iban}</IBAN></Id></CdtrAcct>'
+    '<RmtInf><Ustrd>{ustrd}</Ustrd><Strd><CdtrRefInf>'
+    '<Tp><CdOrPrtry><Cd>SCOR</Cd></CdOrPrtry></Tp><Ref>{ref}</Ref>'
+    '</CdtrRefInf></Strd></RmtInf>'
+    '</CdtTrfTxInf>'
+)
+
+
+def xml_escape(text):
+    # Most cells contain no markup characters; skip escape() for those
+    if '&' in text or '<' in text or '>' in text:
+        return escape(text)
+    return text
+
+
+@st.cache_data(max_entries=8)
 def convert_csv_to_xml(csv_bytes):
-    data = csv_bytes.decode('utf-8')
-    reader = csv.reader(io.StringIO(data))
-    rows = [r for r in reader if any(cell.strip() for cell in r)]
-    if len(rows) < 2:
+    # Decode incrementally and convert in a single pass over the reader
+    reader = csv.reader(io.TextIOWrapper(io.BytesIO(csv_bytes), encoding='utf-8', newline=''))
+    # A row is blank when its cells hold only whitespace
+    rows = (r for r in reader if ''.join(r).strip())
+    header = next(rows, None)
+
+    # Transactions (hot-loop callables bound to locals)
+    txs = []
+    append, render, esc = txs.append, TX_TEMPLATE.format, xml_escape
+    # Attribute entities beyond &<>, matching ElementTree's attribute escaping
+    attr_entities = {'"': '&quot;', '\n': '&#10;', '\r': '&#13;', '\t': '&#09;'}
+    total = Decimal(0)
+    for r in rows:
+        # Pad only the optional trailing columns; rows that stop before the
+        # required creditor IBAN still fail with IndexError below
+        if COL_IBAN < len(r) < ROW_WIDTH:
+            r += [''] * (ROW_WIDTH - len(r))
+        # Decimal comma and thousands spaces, e.g. '1 234,56' -> '1234.56'
+        amount = r[COL_AMOUNT].replace(',', '.').replace(' ', '')
+        total += Decimal(amount)  # also guarantees amount is free of markup
+        ustrd = esc(r[COL_REMITTANCE].strip())
+        e2e = esc(r[COL_E2E].strip()) or ustrd
+        addr1, addr2 = r[COL_ADDR1].strip(), r[COL_ADDR2].strip()
+        combined = f"{addr1}, {addr2}" if addr1 and addr2 else addr1 or addr2
+        adr_line = f"<AdrLine>{esc(combined)}</AdrLine>" if combined else ''
+        # Well-formed IBAN, BIC and currency codes are alphanumeric and need no escaping
+        ccy, bic, iban = r[COL_CURRENCY], r[COL_BIC].strip(), r[COL_IBAN].replace(' ', '')
+        append(render(
+            e2e=e2e,
+            ccy=ccy if ccy.isalnum() else escape(ccy, attr_entities),
+            amt=amount,
+            bic=bic if bic.isalnum() else esc(bic),
+            name=esc(r[COL_NAME].strip()),
+            adr=adr_line,
+            iban=iban if iban.isalnum() else esc(iban),
+            ustrd=ustrd,
+            ref=esc(r[COL_REF].strip()) or 'Ryft',
+        ))
+    if not txs:
         return None
-    header, payments = rows[0], rows[1:]
 
     # Extract header
-    msgid = header[2].strip() or 'MSG1'
-    creation_date = header[32].split()[-1]
-    debtor_name = header[4].strip()
-    debtor_iban = header[3].replace(' ', '')
-    debtor_bic = header[10].strip()
+    msgid = header[COL_MSGID].strip() or 'MSG1'
+    creation_date = header[COL_CREATED].split()[-1]
+    debtor_name = header[COL_NAME].strip()
+    debtor_iban = header[COL_DEBTOR_IBAN].replace(' ', '')
+    debtor_bic = header[COL_BIC].strip()
 
-    # Calculate totals
-    amounts = [Decimal(r[13].replace(',', '.')) for r in payments]
-    ctrl_sum = sum(amounts)
-    nb_tx = len(payments)
+    # Totals
+    ctrl_sum = f"{total:.2f}"
+    nb_tx = str(len(txs))
 
     # Build root Document element with only xsi:schemaLocation
     doc = ET.Element(f'{{{NS}}}Document', {
@@ -44,8 +116,8 @@ def convert_csv_to_xml(csv_bytes):
     grp = ET.SubElement(cstmr, f'{{{NS}}}GrpHdr')
     ET.SubElement(grp, f'{{{NS}}}MsgId').text = msgid
     ET.SubElement(grp, f'{{{NS}}}CreDtTm').text = f"{creation_date}T00:00:00"
-    ET.SubElement(grp, f'{{{NS}}}NbOfTxs').text = str(nb_tx)
-    ET.SubElement(grp, f'{{{NS}}}CtrlSum').text = f"{ctrl_sum:.2f}"
+    ET.SubElement(grp, f'{{{NS}}}NbOfTxs').text = nb_tx
+    ET.SubElement(grp, f'{{{NS}}}CtrlSum').text = ctrl_sum
     initpty = ET.SubElement(grp, f'{{{NS}}}InitgPty')
     ET.SubElement(initpty, f'{{{NS}}}Nm').text = debtor_name
 
@@ -54,8 +126,8 @@ def convert_csv_to_xml(csv_bytes):
     ET.SubElement(pinf, f'{{{NS}}}PmtInfId').text = msgid
     ET.SubElement(pinf, f'{{{NS}}}PmtMtd').text = 'TRF'
     ET.SubElement(pinf, f'{{{NS}}}BtchBookg').text = 'false'
-    ET.SubElement(pinf, f'{{{NS}}}NbOfTxs').text = str(nb_tx)
-    ET.SubElement(pinf, f'{{{NS}}}CtrlSum').text = f"{ctrl_sum:.2f}"
+    ET.SubElement(pinf, f'{{{NS}}}NbOfTxs').text = nb_tx
+    ET.SubElement(pinf, f'{{{NS}}}CtrlSum').text = ctrl_sum
     ptype = ET.SubElement(pinf, f'{{{NS}}}PmtTpInf')
     svc = ET.SubElement(ptype, f'{{{NS}}}SvcLvl')
     ET.SubElement(svc, f'{{{NS}}}Cd').text = 'SEPA'
@@ -73,53 +145,30 @@ def convert_csv_to_xml(csv_bytes):
     ET.SubElement(finid, f'{{{NS}}}BICFI').text = debtor_bic
     ET.SubElement(pinf, f'{{{NS}}}ChrgBr').text = 'SLEV'
 
-    # Transactions
-    for r in payments:
-        tx = ET.SubElement(pinf, f'{{{NS}}}CdtTrfTxInf')
-        pid = ET.SubElement(tx, f'{{{NS}}}PmtId')
-        e2e = r[34].strip() if len(r) > 34 and r[34].strip() else r[2].strip()
-        ET.SubElement(pid, f'{{{NS}}}EndToEndId').text = e2e
-
-        amt = ET.SubElement(tx, f'{{{NS}}}Amt')
-        inst = ET.SubElement(amt, f'{{{NS}}}InstdAmt', Ccy=r[12])
-        inst.text = r[13].replace(',', '.')
-
-        cagt = ET.SubElement(tx, f'{{{NS}}}CdtrAgt')
-        fin = ET.SubElement(cagt, f'{{{NS}}}FinInstnId')
-        ET.SubElement(fin, f'{{{NS}}}BICFI').text = r[10].strip()
-
-        cdt = ET.SubElement(tx, f'{{{NS}}}Cdtr')
-        ET.SubElement(cdt, f'{{{NS}}}Nm').text = r[4].strip()
-        pstl = ET.SubElement(cdt, f'{{{NS}}}PstlAdr')
-        addr1, addr2 = r[5].strip(), r[6].strip()
-        combined = f"{addr1}, {addr2}" if addr1 and addr2 else addr1 or addr2
-        if combined:
-            ET.SubElement(pstl, f'{{{NS}}}AdrLine').text = combined
-
-        cact = ET.SubElement(tx, f'{{{NS}}}CdtrAcct')
-        acid = ET.SubElement(cact, f'{{{NS}}}Id')
-        ET.SubElement(acid, f'{{{NS}}}IBAN').text = r[35].replace(' ', '')
-
-        rmt = ET.SubElement(tx, f'{{{NS}}}RmtInf')
-        ET.SubElement(rmt, f'{{{NS}}}Ustrd').text = r[2].strip()
-        ref_val = r[36].strip() if len(r) > 36 and r[36].strip() else 'Ryft'
-        strd = ET.SubElement(rmt, f'{{{NS}}}Strd')
-        cri = ET.SubElement(strd, f'{{{NS}}}CdtrRefInf')
-        tp = ET.SubElement(cri, f'{{{NS}}}Tp')
-        cdorp = ET.SubElement(tp, f'{{{NS}}}CdOrPrtry')
-        ET.SubElement(cdorp, f'{{{NS}}}Cd').text = 'SCOR'
-        ET.SubElement(cri, f'{{{NS}}}Ref').text = ref_val
-
-    buf = io.BytesIO()
-    ET.ElementTree(doc).write(buf, xml_declaration=True, encoding='utf-8', method='xml')
-    return buf.getvalue()
+    # Serialize everything up to the transactions once; the CdtTrfTxInf
+    # blocks rendered from TX_TEMPLATE are spliced in before </PmtInf>.
+    head = ET.tostring(doc, encoding='utf-8', xml_declaration=True)
+    head, pinf_end, footer = head.rpartition(b'</PmtInf>')
+    return b''.join((head, ''.join(txs).encode('utf-8'), pinf_end, footer))
+
 
 # Streamlit UI
-st.title('CSV to pain.001.001.09 Converter')
-uploaded = st.file_uploader('Upload your CSV file', type='csv')
-if uploaded:
-    xml_bytes = convert_csv_to_xml(uploaded.getvalue())
-    if xml_bytes:
-        st.download_button('Download XML', data=xml_bytes, file_name='payments.xml', mime='application/xml')
-    else:
-        st.error('Failed to parse CSV. Ensure it matches expected format.')
+@st.fragment
+def download_xml(xml_bytes):
+    # Clicking download reruns only this fragment, not the whole script
+    st.download_button('Download XML', data=xml_bytes, file_name='payments.xml', mime='application/xml')
+
+
+def main():
+    st.title('CSV to pain.001.001.09 Converter')
+    uploaded = st.file_uploader('Upload your CSV file', type='csv')
+    if uploaded:
+        xml_bytes = convert_csv_to_xml(uploaded.getvalue())
+        if xml_bytes:
+            download_xml(xml_bytes)
+        else:
+            st.error('Failed to parse CSV. Ensure it matches expected format.')
+
+
+if __name__ == '__main__':
+    main()